@@ -41,43 +41,60 @@ Spreadsheet sheet
       Each row after that contains pairs of tutors that cannot be in the same workshop.
 
 Debugging
-  -   If you run the program and the result it "Unable to retrieve attribute 'x'", then the timetable is infeasible.
-      Try commenting out the last constraint and run the program again. If it's still infeasible, uncomment that
-      constraint and comment out the second last constraint. Repeat until the program is feasible - the constraint you
-      commented out that time is likely the one causing the timetable to be infeasible. Think about what's in your
-      data that could cause problems with that constraint. For example, maybe the tutors' availabilities are too
-      restrictive, or there isn't enough flexibility to schedule a supertutor on the first day of workshops.
+  -   If the timetable is infeasible, the program stops with a list of the groups of constraints that can't all be
+      satisfied, and how much each group would need to be relaxed by (e.g. "NumWorkshops: 2" means the numbers of
+      workshops assigned to tutors would need to change by 2 altogether). Think about what's in your data that could
+      cause problems with those constraints. For example, maybe the tutors' availabilities are too restrictive, or there
+      isn't enough flexibility to schedule a supertutor on the first day of workshops.
       Note: the constraints appear after the line "# --------- The constraints ---------", and look like
-      variable = {i: m.addConstr( ... ) ...} etc. To get rid of one constraint, comment out everything from the
-      "variable = {" down to the closing brace "}"
+      constraints['Name'] = [ ... ]. To get rid of one group of constraints, comment out its line(s).
+
+  -   If the program stops with "The solver ... stopped without finding a timetable", the solver most likely ran out
+      of time (the time limit is 10 minutes with Gurobi) before it found any timetable.
 """
+import os
+import re
 from random import seed
 import cvxpy as cp
-from pandas import DataFrame, read_excel, read_csv
+from pandas import DataFrame, ExcelFile, Series
 import numpy as np
-from itertools import combinations
+from scipy.sparse import csr_matrix
+
+# File extensions of the spreadsheets that can be read
+excel_extensions = frozenset({'xls', 'xlsx', 'xlsm', 'xlsb', 'odf', 'ods', 'odt'})
 
 
-def import_spreadsheet(fname, sname, blank_value):
+def open_spreadsheet(fname):
     """
+    Open the Excel spreadsheet once, so that all of its sheets can be read without re-reading the file.
+
     :param fname: Name of the Excel spreadsheet file, including path
-    :param sname: Name of the sheet in the Excel file
-    :param blank_value: value/string to replace any blank values in the spreadsheet with
-    :return: (pandas.dataframe) dataframe of Excel spreadsheet contents
+    :return: (pandas.ExcelFile) the opened Excel spreadsheet
     """
 
-    # Read in the file as a dataframe. index_col=0 uses the 0th column (tutor names) as the row names
-    # Use read_excel() if the file extension is one of the supported extensions
-    if any([file_name.endswith(x) for x in ['xls', 'xlsx', 'xlsm', 'xlsb', 'odf', 'ods', 'odt']]):
-        df = read_excel(fname, sheet_name=sname, index_col=0)
+    # Only open the file if the file extension is one of the supported extensions.
+    # splitext gives the extension after the last dot, e.g. 'SCIE1000.xlsx' -> '.xlsx'
+    extension = os.path.splitext(fname)[1].lower().lstrip('.')
 
-    # Use read_csv
-    elif file_name.endswith('.csv'):
-        df = read_csv(fname, sheet_name=sname, index_col=0)
+    if extension in excel_extensions:
+        return ExcelFile(fname)
 
     else:
         raise ValueError('The specified file is not a supported file type. Supported types are xls, xlsx, xlsm,'
-                         ' xlsb, odf, ods, odt, and csv.')
+                         ' xlsb, odf, ods, and odt.')
+
+
+def import_spreadsheet(workbook, sname, blank_value):
+    """
+    :param workbook: (pandas.ExcelFile) the opened Excel spreadsheet, see open_spreadsheet()
+    :param sname: Name of the sheet in the Excel file
+    :param blank_value: value/string to replace any blank values in the spreadsheet with
+    :return: (pandas.dataframe) dataframe of Excel spreadsheet contents
+    """
+
+    # Read in the sheet as a dataframe. index_col=0 uses the 0th column (tutor names) as the row names
+    df = workbook.parse(sheet_name=sname, index_col=0)
+
     # Replace blank values with blank_value
     df.fillna(value=blank_value, inplace=True)
     # Remove any whitespace at the start and end of the column headers
@@ -116,6 +133,154 @@ def find_row_name(substring, df):
     return row_matches[0]
 
 
+def convert_to_24hr(hours, suffixes):
+    """
+    Convert times to 24-hr time, e.g. 2pm -> 1400. 12pm is midday (1200).
+
+    :param hours: (pandas series) hour of each time, as a string, e.g. '2'
+    :param suffixes: (pandas series) 'am' or 'pm' for each time (any case)
+    :return: (numpy array) 24-hr time of each time
+    """
+
+    hours = hours.astype(int).to_numpy()
+    is_pm = (suffixes.str.lower() == 'pm').to_numpy()
+
+    # 'am' times and 12pm are hour x 100. Other 'pm' times are hour x 100 + 1200.
+    return np.where(is_pm & (hours != 12), hours * 100 + 1200, hours * 100)
+
+
+def find_overlap_cliques(start_times, workshop_days):
+    """
+    Find the largest groups of workshops that all overlap with each other, i.e. are all on at the same time.
+    Since workshops overlap if they start within an hour of each other on the same day, every such group is the set of
+    workshops starting in the hour after one of the workshops. Groups that are part of a larger group are dropped.
+    The workshops are sorted by day and start time, so each group is a run of consecutive workshops in that order.
+
+    :param start_times: (numpy array) 24-hr start time of each workshop
+    :param workshop_days: (numpy array) day of each workshop
+    :return: (numpy array) cliques[c, w] is True if workshop w is in group c
+    """
+
+    # Sort the workshops by day, then by start time. A 24-hr time is at most 2400, so day_id x 10000 + start time
+    # sorts by day first, and adding 100 (one hour) to it never reaches the next day.
+    day_ids = np.unique(workshop_days, return_inverse=True)[1].ravel()
+    sort_keys = day_ids * 10000 + start_times
+    order = np.argsort(sort_keys, kind='stable')
+    sorted_keys = sort_keys[order]
+
+    # Sweep: the group starting at sorted workshop n ends just before the first workshop starting more than an hour
+    # after it (ends[n] is found by binary search, since the keys are sorted)
+    positions = np.arange(len(order))
+    ends = np.searchsorted(sorted_keys, sorted_keys + 100, side='right')
+
+    # A group is part of the previous group if they both end at the same workshop
+    is_largest = np.ones(len(order), dtype=bool)
+    is_largest[1:] = ends[1:] != ends[:-1]
+    starts, ends = positions[is_largest], ends[is_largest]
+
+    # Mark the sorted workshops in each group, then put the columns back in the original workshop order
+    cliques = np.zeros((len(starts), len(order)), dtype=bool)
+    cliques[:, order] = (positions[None, :] >= starts[:, None]) & (positions[None, :] < ends[:, None])
+
+    return cliques
+
+
+def presolve_allocation(avail_matrix, N_w, capacity, course, cliques):
+    """
+    Find the allocations that are forced by the data, so that the solver doesn't need variables for them.
+    A workshop with exactly as many available tutors as it needs must get all of them, and a workshop that already has
+    enough tutors can't get any more. Similarly for the number of workshops of each course assigned to each tutor.
+    A tutor who must teach a workshop can't teach any workshop on at the same time. Repeat until nothing changes.
+
+    :param avail_matrix: (numpy array) avail_matrix[r, w] is tutor r's preference for workshop w, 0 if not available
+    :param N_w: (numpy array) number of tutors assigned to each workshop
+    :param capacity: (numpy array) capacity[r, c] is the number of workshops of course c assigned to tutor r
+    :param course: (numpy array) course[w] is the column of capacity for the course of workshop w
+    :param cliques: (numpy array) cliques[c, w] is True if workshop w is in group c of workshops on at the same time
+    :return: (numpy array) fixed[r, w] = 1 if tutor r must teach workshop w, 0 if they can't, -1 if it isn't decided
+    """
+
+    # Tutors can't teach workshops they aren't available for. Everything else is undecided to begin with.
+    fixed = np.where(avail_matrix != 0, -1, 0)
+
+    # course_mask[c, w] is True if workshop w is a workshop of course c (column c of capacity)
+    course_mask = course[None, :] == np.arange(capacity.shape[1])[:, None]
+
+    while True:
+        undecided = (fixed == -1).astype(int)
+        allocated = (fixed == 1).astype(int)
+
+        # Workshops: no. of tutors already allocated, and no. of tutors who could still be allocated
+        staffed = allocated.sum(axis=0)
+        staff_left = undecided.sum(axis=0)
+
+        # Tutors: no. of workshops of each course already allocated, and no. that could still be allocated.
+        # Indexing the columns with course gives the values for the course of each workshop, i.e. taught[r, w] is the
+        # no. of workshops of workshop w's course allocated to tutor r.
+        taught = (allocated @ course_mask.T)[:, course]
+        teach_left = (undecided @ course_mask.T)[:, course]
+        tutor_capacity = capacity[:, course]
+
+        # busy[r, w] is True if tutor r is allocated to a workshop on at the same time as workshop w
+        busy = (allocated @ cliques.T > 0).astype(int) @ cliques > 0
+
+        # Every undecided tutor is needed if there are just enough of them (for the workshop, or for the tutor)
+        must_teach = (undecided == 1) & ((staffed + staff_left == N_w)[None, :]
+                                         | (taught + teach_left == tutor_capacity))
+
+        # No more tutors can be added to a full workshop, and a tutor can't teach more than their workload or two
+        # workshops at the same time
+        cant_teach = (undecided == 1) & ((staffed == N_w)[None, :] | (taught == tutor_capacity) | busy)
+
+        # Stop when nothing new has been decided. If the same allocation is both forced and impossible, the timetable
+        # is infeasible, so leave it to the solver (and the infeasibility report).
+        if not (must_teach | cant_teach).any() or (must_teach & cant_teach).any():
+            return fixed
+
+        fixed[must_teach] = 1
+        fixed[cant_teach] = 0
+
+
+def diagnose_infeasibility(constraints, solver, solver_options):
+    """
+    Find the groups of constraints that make the timetable infeasible. Every constraint is relaxed by a non-negative
+    slack variable (how far the constraint is from being satisfied), and the total slack is minimised. The groups that
+    still need some slack can't all be satisfied at the same time.
+
+    :param constraints: (dict) constraints[name] is the list of CVXPY constraints in the group called name
+    :param solver: (str) name of the CVXPY solver to use
+    :param solver_options: (dict) options to pass to the solver
+    :return: (dict) total slack needed by each group of constraints that can't be satisfied, e.g. {'NumWorkshops': 2}.
+        Empty if the solver stopped (e.g. at its time limit) before solving the relaxed problem.
+    """
+
+    slack = {name: [] for name in constraints}
+    relaxed_constraints = []
+
+    for name, group in constraints.items():
+        for constraint in group:
+            # CVXPY stores every constraint as expr == 0 or expr <= 0
+            constraint_slack = cp.Variable(constraint.shape, nonneg=True)
+            slack[name].append(constraint_slack)
+
+            if isinstance(constraint, cp.constraints.Equality):
+                relaxed_constraints.append(cp.abs(constraint.expr) <= constraint_slack)
+            else:
+                relaxed_constraints.append(constraint.expr <= constraint_slack)
+
+    total_slack = cp.sum([cp.sum(s) for group_slack in slack.values() for s in group_slack])
+    cp.Problem(cp.Minimize(total_slack), relaxed_constraints).solve(solver=solver, **solver_options)
+
+    # The relaxed problem is always feasible, so no solution means the solver stopped early
+    if total_slack.value is None:
+        return {}
+
+    # Total slack in each group, keeping the groups that needed any
+    group_slack = {name: sum(np.sum(s.value) for s in group_slack) for name, group_slack in slack.items()}
+
+    return {name: amount for name, amount in group_slack.items() if amount > 1e-6}
+
+
 # Set the random seed for the model solver (Gurobi)
 seed(42)
 
@@ -124,11 +289,14 @@ file_name = input('Enter the file name of the tutor workshop availability Excel
                   ' \nFor example, "Sem 1 2023 resources\\\SCIE1000_availabilities.xlsx"')
 
 # --------- READING IN THE EXCEL SPREADSHEETS ---------
+# Open the spreadsheet once. All the sheets below are read from it.
+workbook = open_spreadsheet(file_name)
+
 # Read in the availabilities spreadsheet as a dataframe, specify 1st sheet
-workshop_avail_df = import_spreadsheet(file_name, sname='Availability', blank_value='NotAvailable')
+workshop_avail_df = import_spreadsheet(workbook, sname='Availability', blank_value='NotAvailable')
 
 # Dataframe for how many workshops assigned to each tutor & tutors' experience
-workshop_num_df = import_spreadsheet(file_name, sname='Allocations', blank_value=0)
+workshop_num_df = import_spreadsheet(workbook, sname='Allocations', blank_value=0)
 
 # Split the above dataframe (df) into a df containing tutors' experience and gender identity, and a df with workshop
 # number allocations
@@ -153,55 +321,39 @@ Time_slots = [time for time in workshop_avail_df.columns]
 # Listed in order given in availability spreadsheet
 Workshops = range(len(Time_slots))
 
-# Dictionary of the day that workshop w is on.
-# Split the workshop name by spaces, then take the 0th result. This should be the day.
-Workshop_day = {w: Time_slots[w].split(' ')[0] for w in Workshops}
+# Day, start time and end time of every workshop, from one pass of a regular expression over the timeslot names.
+# All timeslots look like Day StartTime-EndTime Suffix, e.g. 'Monday 2pm-4pm ILC1' -> 'Monday', '2', 'pm', '4', 'pm'.
+# The series is indexed by timeslot so that errors can name the workshop. Timeslots that don't match are NaN.
+timeslot_parts = Series(Time_slots, index=Time_slots).str.extract(r'^(\S+)\s+(\d+)(am|pm)-(\d+)(am|pm)',
+                                                                  flags=re.IGNORECASE)
 
-# Initialise dictionary for the 24-hr time of each workshop
-# Workshop_time[w][0] -> start time of workshop w. Workshop_time[w][1] -> end time of workshop w.
-Workshop_time = {w: [] for w in Workshops}
+# If a timeslot doesn't match, then something has gone wrong
+if timeslot_parts[0].isna().any():
+    workshop = timeslot_parts.index[timeslot_parts[0].isna()][0]
+    raise ValueError(f"Workshop {workshop} isn't labelled as Day StartTime-EndTime, e.g. 'Monday 2pm-4pm', or its"
+                     f" times don't contain 'am' or 'pm'.")
 
-# Workshop start and end times
-for w in Workshops:
-    workshop = Time_slots[w]
+# Day of each workshop, e.g. workshop_days[w] = 'Monday'
+workshop_days = timeslot_parts[0].to_numpy()
 
-    # Split on the spaces, extract the element in position 1. Since all timeslots look like Day StartTime-EndTime Suffix
-    time_period = workshop.split(' ')[1]
-    # Then split into start and end times
-    time_period = time_period.split('-')
-    # Convert to 24-hr time
-    time_period_24 = []
+# Workshop start and end times in 24-hr time, e.g. start_times[w] -> start time of workshop w.
+start_times = convert_to_24hr(timeslot_parts[1], timeslot_parts[2])
+end_times = convert_to_24hr(timeslot_parts[3], timeslot_parts[4])
 
-    for time in time_period:
-        if 'am' in time.lower() or '12pm' in time.lower():
-            # Remove the 'am' and convert to 24-hour time
-            time_24 = int(time.lower().replace('am', '').replace('pm', '')) * 100
+# is_1100[w] is True if workshop w is a SCIE1100 workshop
+is_1100 = np.fromiter(('1100' in time_slot for time_slot in Time_slots), dtype=bool, count=len(Time_slots))
 
-        elif 'pm' in time.lower():
-            # Remove the 'pm' and convert to 24-hour time.
-            time_24 = int(time.lower().replace('pm', '')) * 100 + 1200
-
-        else:
-            raise ValueError(f"Workshop {workshop} time doesn't contain 'am' or 'pm'.")
-
-        time_period_24.append(time_24)
-
-    # Add the time period of workshop w in 24-hr time to the dictionary
-    Workshop_time[w] = time_period_24
-
-# Create dictionary containing the list of workshops that overlap with workshop w (including workshop w)
+# Groups of workshops that are all on at the same time: overlap_cliques[c, w] is True if workshop w is in group c
+# Workshops overlap if they start up to 1 hour before or up to 1 hour after each other, and are on the same day.
 # Assume that workshops only start on the hour, and all have a duration of 2 hours
-Overlap_workshops = {w: [
-    # List all workshops that start up to 1 hour before or up to 1 hour after workshop w, and are on the same day.
-    v for v in Workshops if abs(Workshop_time[v][0] - Workshop_time[w][0]) <= 100 and Workshop_day[v] == Workshop_day[w]
-] for w in Workshops}
+overlap_cliques = find_overlap_cliques(start_times, workshop_days)
 
 # What day is the first workshop? Need this to schedule a supertutor on first day of workshops
 first_workshop = None
 for day in ['Mon', 'Tues', 'Wed', 'Thur', 'Fri']:
     # If the substring 'mon' appears in any workshop timeslot, then Monday is the first day of workshops.
     # If not Monday, then try Tuesday, etc.
-    if any(day.lower() in workday.lower() for workday in Workshop_day.values()):
+    if any(day.lower() in workday.lower() for workday in workshop_days):
         # The first workshops falls on this day
         first_workshop = day
         break
@@ -211,6 +363,10 @@ if first_workshop is None:
     raise ValueError('Either there are no workshops, or none of the workshop column names contain'
                      ' "Mon", "Tues", "Wed", "Thurs", or "Fri".')
 
+# is_first_day[w] is True if workshop w is on the first day of workshops
+is_first_day = np.fromiter((first_workshop in time_slot for time_slot in Time_slots), dtype=bool,
+                           count=len(Time_slots))
+
 # --------- THE DATA ---------
 # Tutors' preferences for each workshop. "Available" weight is set here. Increase it to more strongly
 # favour "Available" over "If Needed"
@@ -223,20 +379,31 @@ NotAvailable = 0
 workshop_avail_df.replace(to_replace=['Available', 'IfNeeded', 'NotAvailable'],
                           value=[Available, IfNeeded, NotAvailable], inplace=True)
 
-# Dictionary of tutors' availabilities. Each entry in the dictionary is a pandas.Series.
-P_iw = {tutor: workshop_avail_df.loc[tutor] for tutor in Tutors}
+# Matrix of tutors' availabilities. avail_matrix[tutor_idx[i], w] is tutor i's preference for workshop w.
+avail_matrix = workshop_avail_df.loc[Tutors, Time_slots].to_numpy(dtype=float)
 
-# Dictionary of diversity indicator: equals 1 if tutor i and j have different gender identities, 0 otherwise
-Div_ij = {(i, j): (1 if workshop_exp_df.loc[i]['Gender ID'] is not workshop_exp_df.loc[j]['Gender ID'] else 0)
-          for i in Tutors for j in Tutors if i is not j}
+# Row of avail_matrix (and of the variable X_iw) for each tutor
+tutor_idx = {tutor: r for r, tutor in enumerate(Tutors)}
+
+# Gender identity of each tutor, and the list of the different gender identities. Blank entries are 0, so convert
+# everything to strings before comparing.
+gender = workshop_exp_df.loc[Tutors, 'Gender ID'].to_numpy().astype(str)
+genders = np.unique(gender)
+
+# gender_matrix[g, tutor_idx[i]] = 1 if tutor i has gender identity genders[g], 0 otherwise.
+# The [:, None] and [None, :] compare every gender identity with every tutor at once (NumPy broadcasting).
+gender_matrix = (genders[:, None] == gender[None, :]).astype(float)
 
 # Number of tutors assigned to each workshop
 num_tutors_row = find_row_name('tutors', workshop_avail_df)  # First find the row name containing the tutor numbers
-N_w = workshop_avail_df.loc[num_tutors_row]
+N_w = workshop_avail_df.loc[num_tutors_row].to_numpy(dtype=float)
 
 # Number of workshops assigned to each tutor i: [SCIE1000, SCIE1100]
-# e.g. M_i[tutor][0] = SCIE1000,  M_i[tutor][1] = SCIE1100
-M_i = {tutor: [alloc for alloc in workshop_num_df.loc[tutor]] for tutor in Tutors}
+# e.g. M_i[tutor_idx[tutor], 0] = SCIE1000,  M_i[tutor_idx[tutor], 1] = SCIE1100
+M_i = workshop_num_df.loc[Tutors].to_numpy(dtype=int)
+
+# experienced[tutor_idx[i]] is True if tutor i's experience in the Excel sheet 'Allocations' = 1
+experienced = workshop_exp_df.loc[Tutors, 'Experience'].to_numpy() == 1
 
 # List of tutor conflicts. Tuples in this list are conflicting pairs of tutors.
 # Tutor relationship pairs fall in this category.
@@ -245,7 +412,7 @@ conflicts = yes_no_question("Are there any tutor conflicts (yes/no):")
 
 if conflicts.lower() == 'yes':
     # Read in the tutor conflicts
-    workshop_conflict_df = read_excel(file_name, sheet_name='Conflicts')
+    workshop_conflict_df = workbook.parse(sheet_name='Conflicts')
 
     # Create list of tutor conflicts. Each element will be a list [Tutor 0, Tutor 1]
     C_ij = [  # List of the tutors in conflict given in row k of Excel sheet
@@ -273,23 +440,58 @@ if len(Tutors) != len([t for t in workshop_avail_df.index if not t.lower().endsw
 
 # N_w is the no. of tutors assigned to workshop w. M_i is the no. of workshops assigned to tutor i.
 # The total tutors needed to staff all the workshops should equal the total workshops assigned to all tutors.
-if abs(np.sum(N_w) - np.sum([M_i[i] for i in M_i])) > 0.1:
+if abs(np.sum(N_w) - np.sum(M_i)) > 0.1:
     raise ValueError(f'The number of tutors needed to staff all workshops is not equal to the'
                      f' total number of workshops assigned to all tutors.')
 
 # --------- THE MODEL ---------
 
 # --------- The variables ---------
-# X_iw=1 if tutor i is allocated to workshop w, 0 otherwise. Only create variable if tutor can take workshop.
-X_iw = {(i, w): cp.Variable(boolean=True) for i in Tutors for w in Workshops if P_iw[i][w] != 0}
+# course[w] is the column of M_i for workshop w: 0 -> SCIE1000, 1 -> SCIE1100
+if do_scie1100 == 'yes':
+    course = is_1100.astype(int)
+else:
+    course = np.zeros(len(Workshops), dtype=int)
+
+# Decide the allocations that are forced by the data before building the model (see presolve_allocation()).
+# fixed[tutor_idx[i], w] = 1 if tutor i must teach workshop w, 0 if they can't (e.g. they aren't available),
+# and -1 if it's left to the solver
+fixed = presolve_allocation(avail_matrix, N_w, M_i, course, overlap_cliques)
 
-# Y_ijw = 1 if tutors i and j are both allocated to workshop w, 0 otherwise (for workshops that require 2 tutors)
-Y_ijw = {(i, j, w): cp.Variable(boolean=True) for (i, j) in combinations(Tutors, 2) for w in Workshops
-         if N_w[w] == 2 if (i, w) in X_iw if (j, w) in X_iw}
+# Only create a variable for each (tutor, workshop) pair that hasn't been decided.
+# free_cells[k] = [tutor_idx[i], w] is the pair for variable x_k[k].
+free_cells = np.argwhere(fixed == -1)
 
-# Z_ijkw = 1 if tutors i, j, and k are all allocated to workshop w, 0 otherwise (for workshops that require 3 tutors)
-Z_ijkw = {(i, j, k, w): cp.Variable(boolean=True) for (i, j, k) in combinations(Tutors, 3) for w in Workshops
-          if N_w[w] == 3 if (i, w) in X_iw if (j, w) in X_iw if (k, w) in X_iw}
+# X_iw[tutor_idx[i], w]=1 if tutor i is allocated to workshop w, 0 otherwise. X_iw is a matrix expression, so the
+# objective and constraints can be written as matrix expressions rather than sums over thousands of scalar variables.
+if len(free_cells) > 0:
+    x_k = cp.Variable(len(free_cells), boolean=True)
+
+    # The sparse matrix scatter puts x_k[k] in row tutor_idx[i] x no. of workshops + w of the flattened matrix.
+    # The other entries of X_iw are the decided allocations (1 or 0).
+    scatter = csr_matrix((np.ones(len(free_cells)),
+                          (free_cells[:, 0] * len(Workshops) + free_cells[:, 1], np.arange(len(free_cells)))),
+                         shape=(len(Tutors) * len(Workshops), len(free_cells)))
+    X_iw = cp.reshape(scatter @ x_k + (fixed == 1).ravel(), (len(Tutors), len(Workshops)), order='C')
+
+else:
+    # Every allocation has been decided, so X_iw is a constant (CVXPY can't solve with an empty variable). The problem
+    # is still solved, to check the decided timetable against the other constraints, e.g. the experienced tutors.
+    X_iw = cp.Constant((fixed == 1).astype(float))
+
+# Gender diversity is measured in the workshops that require 2 or 3 tutors, by the number of pairs of tutors in the
+# workshop with different gender identities. Rather than a variable for every pair of tutors, count the pairs that have
+# the same gender identity: if c tutors of one gender identity are in a workshop, there are c(c-1)/2 such pairs,
+# i.e. 0, 0, 1, 3 for c = 0, 1, 2, 3.
+# div_workshops is the list of workshops that require 2 or 3 tutors
+div_workshops = np.flatnonzero((N_w == 2) | (N_w == 3))
+
+# S_gw[g, n] >= the number of pairs of tutors in workshop div_workshops[n] who both have gender identity genders[g].
+# The objective penalises S_gw, so it equals that number in the optimal solution.
+S_gw = cp.Variable((len(genders), len(div_workshops)), nonneg=True)
+
+# Number of tutors of each gender identity in each workshop: gender_count[g, n] for workshop div_workshops[n]
+gender_count = gender_matrix @ X_iw[:, div_workshops]
 
 # --------- The objective ---------
 # Maximise tutor preferences, trying to avoid 'if needed' allocations, with a bonus for having high average gender
@@ -298,104 +500,156 @@ Z_ijkw = {(i, j, k, w): cp.Variable(boolean=True) for (i, j, k) in combinations(
 # Max value for sum of gender diversity in 2-tutor workshops is the no. of workshops that require 2 tutors.
 # For 3-tutor workshops, the max value is 3 x the no. of workshops requiring 3 tutors. Dividing the gender diversity
 # term by sum(N_w==2) + 3 x sum(N_w==3) then normalises the average gender diversity.
-objective = cp.Maximize(
-    1 / Available / np.sum(N_w) * sum(P_iw[i][w] * X_iw[i, w] for i in Tutors for w in Workshops if (i, w) in X_iw) \
-    + weight / (np.sum(N_w == 2) + 3 * np.sum(N_w == 3)) * (sum(Y_ijw[i, j, w] * Div_ij[i, j] for (i, j, w) in Y_ijw)
-    + sum(Y_ijw[i, j, w] * Div_ij[i, j] for (i, j, w) in Y_ijw))
-)
+# The no. of pairs of tutors with different gender identities in workshop w is N_w(N_w-1)/2 minus the same-gender pairs
+# The preferences and the weight are CVXPY parameters, so they can be changed and the problem solved again without
+# CVXPY rebuilding the whole problem (see the end of this file).
+# preference[tutor_idx[i], w] is tutor i's normalised preference for workshop w
+preference = cp.Parameter((len(Tutors), len(Workshops)), nonneg=True, value=avail_matrix / Available / np.sum(N_w))
+weight_param = cp.Parameter(nonneg=True, value=weight)
+
+# If no workshops require 2 or 3 tutors, there's no gender diversity to measure (and nothing to normalise by)
+if len(div_workshops) > 0:
+    diversity = (weight_param / (np.sum(N_w == 2) + 3 * np.sum(N_w == 3))
+                 * (np.sum(N_w[div_workshops] * (N_w[div_workshops] - 1) / 2) - cp.sum(S_gw)))
+else:
+    diversity = 0
+
+objective = cp.Maximize(cp.sum(cp.multiply(preference, X_iw)) + diversity)
 
 # --------- The constraints ---------
-# Initialise list to contain all the constraints
-constraints = []
-# Each workshop must have correct number of tutors teaching it
-constraints += [sum(X_iw[i, w] for i in Tutors if (i, w) in X_iw) == N_w[w] for w in Workshops]
+# Initialise dictionary to contain all the constraints. Each entry is a named list of constraints, so that the
+# constraints causing problems can be reported by name if the timetable is infeasible.
+constraints = {}
+# Each workshop must have correct number of tutors teaching it (sum down each column of X_iw)
+constraints['WorkshopsStaffed'] = [cp.sum(X_iw, axis=0) == N_w]
 
 if do_scie1100 == 'no':
-    # Make sure each tutor is allocated the correct number of workshops for SCIE1000
-    # M_i[i] will only have one element, since only SCIE1000 is being run this semester.
-    constraints += [sum(X_iw[i, w] for w in Workshops if (i, w) in X_iw) == M_i[i][0] for i in Tutors]
+    # Make sure each tutor is allocated the correct number of workshops for SCIE1000 (sum along each row of X_iw)
+    # Only the first column of M_i is used, since only SCIE1000 is being run this semester.
+    constraints['NumWorkshops'] = [cp.sum(X_iw, axis=1) == M_i[:, 0]]
 
 elif do_scie1100 == 'yes':
     # Make sure each tutor is allocated the correct number of workshops for SCIE1000
-    # M_i[i] has two elements: M_i[i][0] -> SCIE1000, M_i[i][1] -> SCIE1100
-    constraints += [sum(X_iw[i, w] for w in Workshops if (i, w) in X_iw if '1100' not in Time_slots[w]) == M_i[i][0]
-                    for i in Tutors]
+    # M_i has two columns: M_i[:, 0] -> SCIE1000, M_i[:, 1] -> SCIE1100
+    constraints['NumWorkshops'] = [cp.sum(X_iw[:, ~is_1100], axis=1) == M_i[:, 0]]
 
     # Make sure each tutor is allocated the correct number of workshops for SCIE1100
-    constraints += [sum(X_iw[i, w] for w in Workshops if (i, w) in X_iw if '1100' in Time_slots[w]) == M_i[i][1]
-                    for i in Tutors]
+    constraints['NumWorkshops1100'] = [cp.sum(X_iw[:, is_1100], axis=1) == M_i[:, 1]]
 
 else:
     # If do_scie1100 != 'yes' and !='no', then something has gone wrong :(
     raise ValueError('Invalid input for whether or not SCIE1100 is running this semester.')
 
-# Tutors can teach at most one workshop at a time -> sum over all workshops on same day that overlap with workshop w
+# Tutors can teach at most one workshop at a time -> sum over each group of workshops that are all on at the same time
 # If the workshops start within an hour of each other, they will overlap, provided they are on the same day
-constraints += [sum(X_iw[i, v] for v in Workshops if (i, v) in X_iw
-                    if abs(Workshop_time[v][0] - Workshop_time[w][0]) <= 100
-                    if Workshop_day[v] == Workshop_day[w]) <= 1
-                for i in Tutors for w in Workshops]
+# (X_iw @ overlap_cliques.T)[i, c] is the number of workshops in group c that tutor i is allocated to
+constraints['OnePlaceAtATime'] = [X_iw @ overlap_cliques.T <= 1]
 
 # At least one experienced tutor per workshop (assuming that there are at least two tutors per workshop)
 # A tutor is experienced if their experience in the Excel sheet 'Allocations' = 1
-# If there are workshops with only one tutor, this constraint can be edited to: "workshop_exp_df.loc[i] == 0) <= 1"
+# If there are workshops with only one tutor, this constraint can be edited to: "X_iw[~experienced, :] ... <= 1"
 # to allow for inexperienced tutors tutoring by themselves (unlikely)
-constraints += [sum(X_iw[i, w] for i in Tutors if (i, w) in X_iw if workshop_exp_df.loc[i]['Experience'] == 1)
-                >= 1 for w in Workshops
-                ]
+constraints['AtMostOneInexp'] = [cp.sum(X_iw[experienced, :], axis=0) >= 1]
 
 # If there are any conflicts
 if conflicts.lower() == 'yes':
     # Tutors with conflicts cannot teach together. Note: C_ij contains lists ij = [Tutor i, Tutor j]
-    constraints += [X_iw[i, w] + X_iw[j, w] <= 1
-                    for i, j in C_ij for w in Workshops if (i, w) in X_iw and (j, w) in X_iw]
-
-# A supertutor is ideally teaching a workshop on the first day of workshops during the week.
-# This constraint can be removed if it makes the timetable infeasible.
-constraints += [sum(X_iw[i, w] for w in Workshops if (i, w) in X_iw if first_workshop in Time_slots[w]) >= 1
-                for i in Supertutors]
-
-# Supertutors shouldn't teach the same workshop - inefficient use of resources
-# This constraint can be removed if it makes the timetable infeasible.
-constraints += [sum(X_iw[i, w] for i in Supertutors if (i, w) in X_iw) <= 1
-                for w in Workshops]
-
-# Constraints for Y_ijw and Z_ijkw
-# We want Y_ijw = 1 if and only if X_iw = X_jw = 1 (see comment at definition of Y_ijw)
-for (i, j, w) in Y_ijw:
-    constraints += [Y_ijw[i, j, w] <= X_iw[i, w],  # Y_ijw must be 0 if X_iw is 0 ((remember that Y_ijw is binary)
-                    Y_ijw[i, j, w] <= X_iw[j, w],  # # Y_ijw must be 0 if X_jw is 0
-                    Y_ijw[i, j, w] >= X_iw[i, w] + X_iw[j, w] - 1  # Y_ijw must be 1 if both X_iw and X_jw are 1
-                    ]
-
-for (i, j, k, w) in Z_ijkw:
-    # Z_ijkw must be 0 if any of X_iw, X_jw, X_kw are 0
-    constraints += [Z_ijkw[i, j, k, w] <= X_iw[i, w],
-                    Z_ijkw[i, j, k, w] <= X_iw[j, w],
-                    Z_ijkw[i, j, k, w] <= X_iw[k, w],
-                    # Z_ijkw must be 1 if X_iw, X_jw, and X_kw are all 1
-                    Z_ijkw[i, j, k, w] >= X_iw[i, w] + X_iw[j, w] + X_iw[k, w] - 2
-                    ]
+    # conflict_rows[n] = [tutor_idx[i], tutor_idx[j]] for the nth pair of tutors in C_ij. Sorting each pair and removing
+    # duplicate rows means a pair listed twice (in either order) only gets one set of constraints. Pairs where a tutor
+    # isn't on the Availability sheet (e.g. a tutor from last semester, or a blank cell) are skipped.
+    conflict_rows = np.unique(np.sort(np.array([[tutor_idx[i], tutor_idx[j]] for i, j in C_ij
+                                                if i in tutor_idx and j in tutor_idx], dtype=int)
+                                      .reshape(-1, 2), axis=1), axis=0)
+
+    # One row of constraints per pair of tutors, covering every workshop at once
+    if conflict_rows.size > 0:
+        constraints['NoConflicts'] = [X_iw[conflict_rows[:, 0], :] + X_iw[conflict_rows[:, 1], :] <= 1]
+
+# Rows of X_iw for the supertutors
+super_rows = np.array([tutor_idx[i] for i in Supertutors], dtype=int)
+
+# The supertutor constraints are only needed if there are supertutors
+if len(super_rows) > 0:
+    # A supertutor is ideally teaching a workshop on the first day of workshops during the week.
+    # This constraint can be removed if it makes the timetable infeasible.
+    constraints['SupertutorWorkshop'] = [cp.sum(X_iw[super_rows][:, is_first_day], axis=1) >= 1]
+
+    # Supertutors shouldn't teach the same workshop - inefficient use of resources
+    # This constraint can be removed if it makes the timetable infeasible.
+    constraints['SupertutorOverlap'] = [cp.sum(X_iw[super_rows, :], axis=0) <= 1]
+
+# Constraints for S_gw
+# c(c-1)/2 is 0, 0, 1, 3 for c = 0, 1, 2, 3 tutors of one gender identity. The lines c - 1 and 2c - 3 are both below
+# these values, and at each c one of them (or 0) is equal to it, so S_gw is at least the number of same-gender pairs.
+# A 2-tutor workshop has c <= 2, where 2c - 3 is never above c - 1, so the second line is only needed for 3-tutor
+# workshops. is_three[n] is True if workshop div_workshops[n] requires 3 tutors.
+if len(div_workshops) > 0:
+    is_three = N_w[div_workshops] == 3
+    constraints['SameGenderPairs'] = [S_gw >= gender_count - 1]
+
+    if is_three.any():
+        constraints['SameGenderPairs'] += [S_gw[:, is_three] >= 2 * gender_count[:, is_three] - 3]
 
 # ------------- Manual constraints - tutor preferences -------------
 # Tutors can be manually scheduled by using the following line of code (replace occurrences of TUTOR with tutor's name,
 # and replace TIMESLOT with the name of the workshop as is appears in the list Time_slots)
 
-# TUTORPreference = m.addConstr(X_iw['TUTOR', Time_slots.index('TIMESLOT')] == 1)
+# constraints['TUTORPreference'] = [X_iw[tutor_idx['TUTOR'], Time_slots.index('TIMESLOT')] == 1]
 
 # Alternatively, you can include tutors' general preferences for a specific day or time with the following line of code
 # (replace occurrences of TUTOR with tutor's name, and DETAIL with the specific day or time, e.g. 'Mon' or '8am')
-# TUTORPreference = m.addConstr(sum(X_iw['TUTOR', w] for w in Workshops if DETAIL in Time_slots[w]) >= 1)
-
-problem = cp.Problem(objective, constraints)
-problem.solve()
-#
-# # Save the results as a dataframe. For each workshop, mark the allocated tutors with an X.
-results_df = DataFrame(index=np.array(Tutors), columns=np.array(Time_slots))
-for (i, w) in X_iw:
-    if X_iw[i, w].value > 0.9:
-        print()
-        results_df.loc[i, Time_slots[w]] = 'X'
+# constraints['TUTORPreference'] = [cp.sum(X_iw[tutor_idx['TUTOR'], [w for w in Workshops if DETAIL in Time_slots[w]]])
+#                                    >= 1]
+
+# The problem uses every constraint in every group
+problem = cp.Problem(objective, [constraint for group in constraints.values() for constraint in group])
+
+# --------- Solving ---------
+# Use a mixed-integer solver that can search in parallel. Gurobi is used if it's installed, otherwise the free solvers
+# HiGHS, CBC, and GLPK are tried in that order (GLPK only uses one thread).
+# The solver options use all the CPU cores, and stop when the solution is within 0.01% of optimal or after 10 minutes.
+threads = os.cpu_count() or 1
+solver_options = {
+    cp.GUROBI: {'Threads': threads, 'MIPGap': 1e-4, 'TimeLimit': 600},
+    cp.HIGHS: {'threads': threads, 'parallel': 'on', 'mip_rel_gap': 1e-4, 'time_limit': 600},
+    cp.CBC: {'numberThreads': threads, 'allowableFractionGap': 1e-4, 'maximumSeconds': 600},
+    cp.GLPK_MI: {'mip_gap': 1e-4, 'tm_lim': 600 * 1000},  # GLPK's time limit is in milliseconds
+}
+
+solver = next((name for name in solver_options if name in cp.installed_solvers()), None)
+if solver is None:
+    raise ImportError('No mixed-integer solver is installed. Install one of gurobipy (Gurobi), highspy (HiGHS),'
+                      ' cylp (CBC), or cvxopt (GLPK).')
+
+problem.solve(solver=solver, **solver_options[solver])
+
+# If the timetable is infeasible, find which groups of constraints can't all be satisfied.
+# Gurobi can report "infeasible or unbounded" without deciding which. Tutors can only be allocated or not, so the
+# objective can't be unbounded and that also means the timetable is infeasible.
+if problem.status in (cp.INFEASIBLE, cp.INFEASIBLE_INACCURATE, cp.settings.INFEASIBLE_OR_UNBOUNDED):
+    violations = diagnose_infeasibility(constraints, solver, solver_options[solver])
+
+    # CVXPY also reports Gurobi hitting its time limit without a timetable as infeasible, so only raise if some
+    # constraints really can't be satisfied. Otherwise, the check below reports that the solver stopped.
+    if violations:
+        raise ValueError('The timetable is infeasible. These constraints need to be relaxed (by the amount shown):\n'
+                         + '\n'.join(f'  {name}: {amount:g}' for name, amount in violations.items()))
+
+# To try a different weighting or different preferences, change the parameters and solve again, e.g.
+# weight_param.value = 0.5
+# preference.value[tutor_idx['TUTOR'], Time_slots.index('TIMESLOT')] = IfNeeded / Available / np.sum(N_w)
+# problem.solve(solver=solver, **solver_options[solver])
+# Only the values of the parameters change, so CVXPY reuses the problem it has already built for the solver.
+# Workshops a tutor isn't available for must stay unavailable (the preference can't be changed from 0).
+
+# If the solver stopped without finding a timetable for any other reason (e.g. it hit the time limit first), then there
+# are no results to save
+if X_iw.value is None:
+    raise ValueError(f'The solver ({solver}) stopped without finding a timetable. Solver status: {problem.status}.')
+
+# Save the results as a dataframe. For each workshop, mark the allocated tutors with an X.
+# X_iw.value is the whole matrix of solution values. Unallocated entries are left blank (None).
+results_df = DataFrame(np.where(X_iw.value > 0.9, 'X', None), index=np.array(Tutors), columns=np.array(Time_slots))
 
 # Export the allocation dataframe to an Excel file
 results_df.to_excel('tutor_workshop_schedule.xlsx', sheet_name='Timetable', index=True)
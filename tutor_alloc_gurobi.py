@@ -42,36 +42,59 @@ Debugging
       data that could cause problems with that constraint. For example, maybe the tutors' availabilities are too
       restrictive, or there isn't enough flexibility to schedule a supertutor on the first day of workshops.
       Note: the constraints appear after the line "# --------- The constraints ---------", and look like
-      variable = {i: m.addConstr( ... ) ...} etc. To get rid of one constraint, comment out everything from the
-      "variable = {" down to the closing brace "}"
+      variable = m.addConstr( ... ). To get rid of one constraint, comment out everything from the
+      "variable = m.addConstr(" down to the closing bracket ")"
+
+Parameter tuning
+  -   Run the program with "python tutor_alloc_gurobi.py --tune" to have Gurobi search for solver settings that
+      solve the model faster. This takes up to 10 minutes. The best settings are saved to tutor_alloc.prm, which is
+      loaded automatically on later runs. Delete tutor_alloc.prm to go back to the default settings.
 """
-from random import seed
-from gurobipy import Model, GRB, quicksum
-from pandas import DataFrame, read_excel, read_csv
+import os
+import sys
+from importlib.util import find_spec
+from gurobipy import Model, GRB
+from pandas import Categorical, DataFrame, ExcelFile, Series
 import numpy as np
 from itertools import combinations
 
+# xlsxwriter is optional. If it's installed, it's used to write the timetable, since it's faster than openpyxl.
+# Otherwise (None) pandas uses its default Excel writer.
+excel_engine = 'xlsxwriter' if find_spec('xlsxwriter') is not None else None
+
 
-def import_spreadsheet(fname, sname, blank_value):
+def open_spreadsheet(fname):
     """
+    Open the Excel spreadsheet once, so that all of its sheets can be read without re-reading the file.
+
     :param fname: Name of the Excel spreadsheet file, including path
-    :param sname: Name of the sheet in the Excel file
-    :param blank_value: value/string to replace any blank values in the spreadsheet with
-    :return: (pandas.dataframe) dataframe of Excel spreadsheet contents
+    :return: (pandas.ExcelFile) the opened Excel spreadsheet
     """
 
-    # Read in the file as a dataframe. index_col=0 uses the 0th column (tutor names) as the row names
-    # Use read_excel() if the file extension is one of the supported extensions
-    if any([file_name.endswith(x) for x in ['xls', 'xlsx', 'xlsm', 'xlsb', 'odf', 'ods', 'odt']]):
-        df = read_excel(fname, sheet_name=sname, index_col=0)
-
-    # Use read_csv
-    elif file_name.endswith('.csv'):
-        df = read_csv(fname, sheet_name=sname, index_col=0)
+    # Only open the file if the file extension is one of the supported extensions
+    if any([fname.endswith(x) for x in ['xls', 'xlsx', 'xlsm', 'xlsb', 'odf', 'ods', 'odt']]):
+        # The calamine engine (pip install python-calamine) reads spreadsheets much faster than the default engines.
+        # If it isn't installed, or pandas is too old to support it, use pandas' default engine instead.
+        try:
+            return ExcelFile(fname, engine='calamine')
+        except (ImportError, ValueError):
+            return ExcelFile(fname)
 
     else:
         raise ValueError('The specified file is not a supported file type. Supported types are xls, xlsx, xlsm,'
-                         ' xlsb, odf, ods, odt, and csv.')
+                         ' xlsb, odf, ods, and odt.')
+
+
+def import_spreadsheet(workbook, sname, blank_value):
+    """
+    :param workbook: (pandas.ExcelFile) the opened Excel spreadsheet, see open_spreadsheet()
+    :param sname: Name of the sheet in the Excel file
+    :param blank_value: value/string to replace any blank values in the spreadsheet with
+    :return: (pandas.dataframe) dataframe of Excel spreadsheet contents
+    """
+
+    # Read in the sheet as a dataframe. index_col=0 uses the 0th column (tutor names) as the row names
+    df = workbook.parse(sheet_name=sname, index_col=0)
 
     # Replace blank values with blank_value
     df.fillna(value=blank_value, inplace=True)
@@ -111,19 +134,111 @@ def find_row_name(substring, df):
     return row_matches[0]
 
 
-# Set the random seed for the model solver (Gurobi)
-seed(42)
+def convert_to_24hr(times):
+    """
+    Convert a series of 12-hr times to 24-hr times, e.g. '2pm' -> 1400 and '10am' -> 1000.
+
+    :param times: (pandas series) 12-hr times as strings, indexed by the workshop they belong to
+    :return: (numpy array) 24-hr times as integers
+    """
+
+    # Split each time into the hour and 'am'/'pm', e.g. '2pm' -> ['2', 'pm']. Times that don't match are NaN.
+    parts = times.str.lower().str.extract(r'^(\d+)(am|pm)$')
+
+    if parts[0].isna().any():
+        workshop = parts.index[parts[0].isna()][0]
+        raise ValueError(f"Workshop {workshop} time doesn't contain 'am' or 'pm'.")
+
+    hours = parts[0].astype(int).to_numpy()
+    is_pm = (parts[1] == 'pm').to_numpy()
+
+    # 'am' times and 12pm are hour x 100. Other 'pm' times are hour x 100 + 1200.
+    return np.where(is_pm & (hours != 12), hours * 100 + 1200, hours * 100)
+
+
+def build_overlap(start_times, day_ids):
+    """
+    Create matrix of workshops that overlap. Workshops overlap if they start up to 1 hour before or up to 1 hour after
+    each other, and are on the same day.
+
+    :param start_times: (numpy array) 24-hr start time of each workshop
+    :param day_ids: (numpy array) integer label for the day of each workshop
+    :return: (numpy array) overlap[w, v] is True if workshop v overlaps with workshop w (including w=v)
+    """
+
+    # The [:, None] and [None, :] compare every pair of workshops at once (NumPy broadcasting).
+    return ((np.abs(start_times[:, None] - start_times[None, :]) <= 100)
+            & (day_ids[:, None] == day_ids[None, :]))
+
+
+def find_overlap_cliques(overlap, start_times):
+    """
+    Find the largest groups of workshops that all overlap with each other, i.e. are all on at the same time.
+    Since workshops overlap if they start within an hour of each other on the same day, every such group is the set of
+    workshops starting in the hour after one of the workshops. Groups that are part of a larger group are dropped.
+
+    :param overlap: (numpy array) overlap[w, v] is True if workshop v overlaps with workshop w, see build_overlap()
+    :param start_times: (numpy array) 24-hr start time of each workshop
+    :return: (numpy array) cliques[c, w] is True if workshop w is in group c
+    """
+
+    # Row w is the workshops that overlap with workshop w and start at the same time or after it. Remove duplicates.
+    windows = np.unique(overlap & (start_times[None, :] >= start_times[:, None]), axis=0)
+
+    # is_subset[c, d] is True if group c is part of a different group d (nothing in c is missing from d)
+    is_subset = ~(windows[:, None, :] & ~windows[None, :, :]).any(axis=2)
+    np.fill_diagonal(is_subset, False)
+
+    return windows[~is_subset.any(axis=1)]
+
+
+def greedy_allocation(avail_matrix, N_w, capacity, course, overlap):
+    """
+    Quickly allocate tutors to workshops, one workshop at a time, to give the solver a starting allocation.
+    Each workshop is given the available tutors who most prefer it, skipping tutors who have no workshops of that course
+    left or who are already teaching an overlapping workshop. The result may not satisfy every constraint.
+
+    :param avail_matrix: (numpy array) avail_matrix[r, w] is tutor r's preference for workshop w, 0 if not available
+    :param N_w: (numpy array) number of tutors assigned to each workshop
+    :param capacity: (numpy array) capacity[r, c] is the number of workshops of course c assigned to tutor r
+    :param course: (numpy array) course[w] is the column of capacity for the course of workshop w
+    :param overlap: (numpy array) overlap[w, v] is True if workshops w and v overlap
+    :return: (numpy array) allocation[r, w] = 1 if tutor r is allocated to workshop w, 0 otherwise
+    """
+
+    remaining = capacity.copy()
+    allocation = np.zeros(avail_matrix.shape, dtype=int)
+
+    # Staff the workshops with the fewest available tutors first, since they are the hardest to fill
+    for w in np.argsort((avail_matrix != 0).sum(axis=0), kind='stable'):
+        c = course[w]
+        # Tutors who can take workshop w: available, have workshops of this course left, and not teaching at that time
+        candidates = np.flatnonzero((avail_matrix[:, w] != 0) & (remaining[:, c] > 0)
+                                    & ~allocation[:, overlap[w]].any(axis=1))
+
+        # Highest preference first, then the tutors with the most workshops left to allocate
+        order = np.lexsort((-remaining[candidates, c], -avail_matrix[candidates, w]))
+        chosen = candidates[order][:N_w[w]]
+
+        allocation[chosen, w] = 1
+        remaining[chosen, c] -= 1
+
+    return allocation
+
 
 file_name = input('Enter the file name of the tutor workshop availability Excel spreadsheet'
                   ' (including path, use \\\ instead of single \)'
                   ' \nFor example, "Sem 1 2023 resources\\\SCIE1000_1100_availabilities.xlsx"')
 
 # --------- READING IN THE EXCEL SPREADSHEETS ---------
+# Open the spreadsheet file. All of the sheets are read from this, so the file is only opened and parsed once.
+workbook = open_spreadsheet(file_name)
+
 # Read in the availabilities spreadsheet as a dataframe, specify 1st sheet
-workshop_avail_df = import_spreadsheet(file_name, sname='Availability', blank_value='NotAvailable')
+workshop_avail_df = import_spreadsheet(workbook, sname='Availability', blank_value='NotAvailable')
 
 # Dataframe for how many workshops assigned to each tutor & tutors' experience
-workshop_num_df = import_spreadsheet(file_name, sname='Allocations', blank_value=0)
+workshop_num_df = import_spreadsheet(workbook, sname='Allocations', blank_value=0)
 
 # Split the above dataframe (df) into a df containing tutors' experience and gender identity, and a df with workshop
 # number allocations
@@ -148,64 +263,47 @@ Time_slots = [time for time in workshop_avail_df.columns]
 # Listed in order given in availability spreadsheet
 Workshops = range(len(Time_slots))
 
-# Dictionary of the day that workshop w is on.
-# Split the workshop name by spaces, then take the 0th result. This should be the day.
-Workshop_day = {w: Time_slots[w].split(' ')[0] for w in Workshops}
-
-# Initialise dictionary for the 24-hr time of each workshop
-# Workshop_time[w][0] -> start time of workshop w. Workshop_time[w][1] -> end time of workshop w.
-Workshop_time = {w: [] for w in Workshops}
-
-# Workshop start and end times
-for w in Workshops:
-    workshop = Time_slots[w]
+# All the workshop information below comes from one split of the timeslot names.
+# Split each name on the spaces, since all timeslots look like Day StartTime-EndTime Suffix: element 0 is the day and
+# element 1 is the time period. The series is indexed by timeslot so that errors can name the workshop.
+timeslot_parts = Series(Time_slots, index=Time_slots).str.split(' ')
 
-    # Split on the spaces, extract the element in position 1. Since all timeslots look like Day StartTime-EndTime Suffix
-    time_period = workshop.split(' ')[1]
-    # Then split into start and end times
-    time_period = time_period.split('-')
-    # Convert to 24-hr time
-    time_period_24 = []
+# Day of each workshop (lowercase), e.g. workshop_days[w] = 'monday'
+# day_ids[w] is an integer label for the day of workshop w, so that workshop_days[w] == unique_days[day_ids[w]]
+workshop_days = timeslot_parts.str[0].str.lower().to_numpy()
+unique_days, day_ids = np.unique(workshop_days, return_inverse=True)
 
-    for time in time_period:
-        if 'am' in time.lower() or '12pm' in time.lower():
-            # Remove the 'am' and convert to 24-hour time
-            time_24 = int(time.lower().replace('am', '').replace('pm', '')) * 100
+# Workshop start and end times in 24-hr time, e.g. start_times[w] -> start time of workshop w.
+# Split the time period into start and end times, e.g. '2pm-4pm' -> ['2pm', '4pm']
+time_periods = timeslot_parts.str[1].str.split('-')
+start_times = convert_to_24hr(time_periods.str[0])
+end_times = convert_to_24hr(time_periods.str[1])
 
-        elif 'pm' in time.lower():
-            # Remove the 'pm' and convert to 24-hour time.
-            time_24 = int(time.lower().replace('pm', '')) * 100 + 1200
+# is_1100[w] is True if workshop w is a SCIE1100 workshop
+is_1100 = Series(Time_slots).str.contains('1100', regex=False).to_numpy()
 
-        else:
-            raise ValueError(f"Workshop {workshop} time doesn't contain 'am' or 'pm'.")
-
-        time_period_24.append(time_24)
-
-    # Add the time period of workshop w in 24-hr time to the dictionary
-    Workshop_time[w] = time_period_24
-
-# Create dictionary containing the list of workshops that overlap with workshop w (including workshop w)
+# Create matrix of workshops that overlap: overlap[w, v] is True if workshop v overlaps with workshop w (including w=v)
 # Assume that workshops only start on the hour, and all have a duration of 2 hours
-Overlap_workshops = {w: [
-    # List all workshops that start up to 1 hour before or up to 1 hour after workshop w, and are on the same day.
-    v for v in Workshops if abs(Workshop_time[v][0] - Workshop_time[w][0]) <= 100 and Workshop_day[v] == Workshop_day[w]
-] for w in Workshops}
+overlap = build_overlap(start_times, day_ids)
+
+# Groups of workshops that are all on at the same time: overlap_cliques[c, w] is True if workshop w is in group c
+overlap_cliques = find_overlap_cliques(overlap, start_times)
 
 # What day is the first workshop? Need this to schedule a supertutor on first day of workshops
-first_workshop = None
-for day in ['Mon', 'Tues', 'Wed', 'Thur', 'Fri']:
-    # If the substring 'mon' appears in any workshop timeslot, then Monday is the first day of workshops.
-    # If not Monday, then try Tuesday, etc.
-    if any(day.lower() in workday.lower() for workday in Workshop_day.values()):
-        # The first workshops falls on this day
-        first_workshop = day
-        break
-
-# If we get through the loop without changing the value of first_workshop, then something has gone wrong
-if first_workshop is None:
+# day_rank[d] is the position in the week of unique_days[d]: 0 if the substring 'mon' appears in it, 1 for 'tues', etc.
+# Days that aren't recognised are ranked last. Only the (few) distinct days are checked, not every workshop.
+week_days = ['Mon', 'Tues', 'Wed', 'Thur', 'Fri']
+day_rank = np.array([next((rank for rank, day in enumerate(week_days) if day.lower() in workshop_day), len(week_days))
+                     for workshop_day in unique_days], dtype=int)
+
+# If none of the days appear in the workshop names, then something has gone wrong
+if len(day_rank) == 0 or day_rank.min() == len(week_days):
     raise ValueError('Either there are no workshops, or none of the workshop column names contain'
                      ' "Mon", "Tues", "Wed", "Thurs", or "Fri".')
 
+# is_first_day[w] is True if workshop w is on the first day of workshops, i.e. the lowest ranked day
+is_first_day = day_rank[day_ids] == day_rank.min()
+
 # --------- THE DATA ---------
 # Tutors' preferences for each workshop. "Available" weight is set here. Increase it to more strongly
 # favour "Available" over "If Needed"
@@ -213,13 +311,30 @@ Available = 10
 IfNeeded = 1
 NotAvailable = 0
 
-# The Availability dataframe entries are all strings. This alters the existing dataframe by
-# replacing the strings with the variables Available, IfNeeded, and NotAvailable.
-workshop_avail_df.replace(to_replace=['Available', 'IfNeeded', 'NotAvailable'],
-                          value=[Available, IfNeeded, NotAvailable], inplace=True)
+# The Availability dataframe entries are all strings. Convert them to categorical codes, i.e. 'Available' -> 0,
+# 'IfNeeded' -> 1, 'NotAvailable' -> 2, and any other entry -> -1, then look up the preference for each code.
+availability_levels = ['Available', 'IfNeeded', 'NotAvailable']
+avail_strings = workshop_avail_df.loc[Tutors, Time_slots].to_numpy()
+avail_codes = Categorical(avail_strings.ravel(), categories=availability_levels).codes.reshape(avail_strings.shape)
+
+if (avail_codes == -1).any():
+    r, w = np.argwhere(avail_codes == -1)[0]
+    raise ValueError(f"{Tutors[r]}'s availability for {Time_slots[w]} is '{avail_strings[r, w]}'. Entries should be"
+                     f" 'Available', 'IfNeeded', or 'NotAvailable' (no spaces).")
+
+# Matrix of tutors' availabilities, converted once from the dataframe so the model isn't built from pandas lookups.
+# avail_matrix[r, w] is the preference of tutor Tutors[r] for workshop w.
+avail_matrix = np.array([Available, IfNeeded, NotAvailable], dtype=np.int8)[avail_codes]
+
+# Dictionary of the row in avail_matrix for each tutor, e.g. avail_matrix[tutor_idx['Tutor A'], w]
+tutor_idx = {tutor: r for r, tutor in enumerate(Tutors)}
 
-# Dictionary of tutors' availabilities. Each entry in the dictionary is a pandas.Series.
-P_iw = {tutor: workshop_avail_df.loc[tutor] for tutor in Tutors}
+# avail_bool[r, w] is True if tutor Tutors[r] can take workshop w
+avail_bool = avail_matrix != 0
+
+# experienced[r] is True if tutor Tutors[r] is experienced, i.e. their experience in the Excel sheet 'Allocations' = 1
+# Looked up once for all tutors, in the same order as the rows of avail_matrix.
+experienced = workshop_exp_df.loc[Tutors, 'Experience'].to_numpy() == 1
 
 # Dictionary of diversity indicator: equals 1 if tutor i and j have different gender identities, 0 otherwise
 Div_ij = {(i, j): (1 if workshop_exp_df.loc[i]['Gender ID'] is not workshop_exp_df.loc[j]['Gender ID'] else 0)
@@ -227,11 +342,11 @@ Div_ij = {(i, j): (1 if workshop_exp_df.loc[i]['Gender ID'] is not workshop_exp_
 
 # Number of tutors assigned to each workshop
 num_tutors_row = find_row_name('tutors', workshop_avail_df)  # First find the row name containing the tutor numbers
-N_w = workshop_avail_df.loc[num_tutors_row]
+N_w = workshop_avail_df.loc[num_tutors_row, Time_slots].to_numpy(dtype=int)
 
-# Number of workshops assigned to each tutor i: [SCIE1000, SCIE1100]
-# e.g. M_i[tutor][0] = SCIE1000,  M_i[tutor][1] = SCIE1100
-M_i = {tutor: [alloc for alloc in workshop_num_df.loc[tutor]] for tutor in Tutors}
+# Matrix of the number of workshops assigned to each tutor: [SCIE1000, SCIE1100]
+# e.g. M_i[tutor_idx[tutor], 0] = SCIE1000,  M_i[tutor_idx[tutor], 1] = SCIE1100
+M_i = workshop_num_df.loc[Tutors].to_numpy(dtype=int)
 
 # List of tutor conflicts. Tuples in this list are conflicting pairs of tutors.
 # Tutor relationship pairs fall in this category.
@@ -239,9 +354,8 @@ M_i = {tutor: [alloc for alloc in workshop_num_df.loc[tutor]] for tutor in Tutor
 conflicts = yes_no_question("Are there any tutor conflicts (yes/no):")
 
 if conflicts.lower() == 'yes':
-    # Read in the tutor conflicts
-    workshop_conflict_df = read_excel('Sem 1 2023 resources\\SCIE1000_1100_availabilities.xlsx',
-                                      sheet_name='Conflicts')
+    # Read in the tutor conflicts from the same spreadsheet
+    workshop_conflict_df = workbook.parse(sheet_name='Conflicts')
 
     # Create list of tutor conflicts. Each element will be a list [Tutor 0, Tutor 1]
     C_ij = [  # List of the tutors in conflict given in row k of Excel sheet
@@ -264,7 +378,7 @@ if len(Tutors) != len([t for t in workshop_avail_df.index if not t.lower().endsw
 
 # N_w is the no. of tutors assigned to workshop w. M_i is the no. of workshops assigned to tutor i.
 # The total tutors needed to staff all the workshops should equal the total workshops assigned to all tutors.
-if abs(np.sum(N_w) - np.sum([M_i[i] for i in M_i])) > 0.1:
+if abs(np.sum(N_w) - np.sum(M_i)) > 0.1:
     raise ValueError(f'The number of tutors needed to staff all workshops is not equal to the'
                      f' total number of workshops assigned to all tutors.')
 
@@ -272,16 +386,24 @@ if abs(np.sum(N_w) - np.sum([M_i[i] for i in M_i])) > 0.1:
 m = Model('tutor_alloc')
 
 # --------- The variables ---------
-# X_iw=1 if tutor i is allocated to workshop w, 0 otherwise. Only create variable if tutor can take workshop.
-X_iw = {(i, w): m.addVar(vtype=GRB.BINARY) for i in Tutors for w in Workshops if P_iw[i][w] != 0}
+# X_iw[tutor_idx[i], w]=1 if tutor i is allocated to workshop w, 0 otherwise. X_iw is a matrix variable (MVar), so the
+# objective and constraints can be written as matrix expressions. Tutors can't be allocated to workshops they aren't
+# available for, so those entries have an upper bound of 0 (Gurobi's presolve removes them from the model).
+X_iw = m.addMVar((len(Tutors), len(Workshops)), vtype=GRB.BINARY, ub=avail_bool.astype(float))
 
 # Y_ijw = 1 if tutors i and j are both allocated to workshop w, 0 otherwise (for workshops that require 2 tutors)
-Y_ijw = {(i, j, w): m.addVar(vtype=GRB.BINARY) for (i, j) in combinations(Tutors, 2) for w in Workshops
-         if N_w[w] == 2 if (i, w) in X_iw if (j, w) in X_iw}
+# Only pairs of tutors that are both available for workshop w are needed, so take the pairs from the (short) list of
+# available tutors for each workshop. Y_rows[n] = [tutor_idx[i], tutor_idx[j], w] for Y_ijw[n].
+Y_rows = np.array([[r, s, w] for w in Workshops if N_w[w] == 2
+                   for (r, s) in combinations(np.flatnonzero(avail_bool[:, w]), 2)], dtype=int).reshape(-1, 3)
+Y_ijw = m.addMVar(len(Y_rows), vtype=GRB.BINARY)
 
 # Z_ijkw = 1 if tutors i, j, and k are all allocated to workshop w, 0 otherwise (for workshops that require 3 tutors)
-Z_ijkw = {(i, j, k, w): m.addVar(vtype=GRB.BINARY) for (i, j, k) in combinations(Tutors, 3) for w in Workshops
-          if N_w[w] == 3 if (i, w) in X_iw if (j, w) in X_iw if (k, w) in X_iw}
+# Z_rows[n] = [tutor_idx[i], tutor_idx[j], tutor_idx[k], w] for Z_ijkw[n]
+Z_rows = np.array([[r, s, t, w] for w in Workshops if N_w[w] == 3
+                   for (r, s, t) in combinations(np.flatnonzero(avail_bool[:, w]), 3)], dtype=int).reshape(-1, 4)
+Z_ijkw = m.addMVar(len(Z_rows), vtype=GRB.BINARY)
+
 # --------- The objective ---------
 # Maximise tutor preferences, trying to avoid 'if needed' allocations, with a bonus for having high average gender
 # diversity in workshop allocations.
@@ -289,117 +411,164 @@ Z_ijkw = {(i, j, k, w): m.addVar(vtype=GRB.BINARY) for (i, j, k) in combinations
 # Max value for sum of gender diversity in 2-tutor workshops is the no. of workshops that require 2 tutors.
 # For 3-tutor workshops, the max value is 3 x the no. of workshops requiring 3 tutors. Dividing the appropriate terms
 # by sum(N_w==2) and 3 x sum(N_w==3) normalises them; dividing by 2 will normalise the entire gender diversity term.
+# Y_div[n] is the diversity indicator Div_ij for the pair of tutors in Y_rows[n]
+Y_div = np.array([Div_ij[Tutors[r], Tutors[s]] for (r, s, w) in Y_rows], dtype=float)
 m.setObjective(
-    1 / Available / np.sum(N_w) * quicksum(P_iw[i][w] * X_iw[i, w] for i in Tutors for w in Workshops if (i, w) in X_iw)
-    + weight / (np.sum(N_w == 2) + 3 * np.sum(N_w == 3)) * (
-                quicksum(Y_ijw[i, j, w] * Div_ij[i, j] for (i, j, w) in Y_ijw)
-                + quicksum(Y_ijw[i, j, w] * Div_ij[i, j] for (i, j, w) in Y_ijw))
+    1 / Available / np.sum(N_w) * (avail_matrix * X_iw).sum()
+    + weight / (np.sum(N_w == 2) + 3 * np.sum(N_w == 3)) * (Y_div @ Y_ijw + Y_div @ Y_ijw)
     , GRB.MAXIMIZE)
 
 # --------- The constraints ---------
-# Each workshop must have correct number of tutors teaching it
-WorkshopsStaffed = {w: m.addConstr(quicksum(X_iw[i, w] for i in Tutors if (i, w) in X_iw) == N_w[w])
-                    for w in Workshops}
+# Each workshop must have correct number of tutors teaching it (sum down each column of X_iw)
+WorkshopsStaffed = m.addConstr(X_iw.sum(axis=0) == N_w)
 
 # Are there any SCIE1100 workshops to schedule?
 do_scie1100 = yes_no_question("Are you scheduling SCIE1100 as well as SCIE1000? (yes/no)")
 
 if do_scie1100.lower() == 'no':
-    # Make sure each tutor is allocated the correct number of workshops for SCIE1000
-    # M_i[i] will only have one element, since only SCIE1000 is being run this semester.
-    NumWorkshops = {i: m.addConstr(quicksum(X_iw[i, w] for w in Workshops if (i, w) in X_iw) == M_i[i][0])
-                    for i in Tutors}
+    # Make sure each tutor is allocated the correct number of workshops for SCIE1000 (sum along each row of X_iw)
+    # Only the first column of M_i is used, since only SCIE1000 is being run this semester.
+    NumWorkshops = m.addConstr(X_iw.sum(axis=1) == M_i[:, 0])
 
 elif do_scie1100.lower() == 'yes':
     # Make sure each tutor is allocated the correct number of workshops for SCIE1000
-    # M_i[i] has two elements: M_i[i][0] -> SCIE1000, M_i[i][1] -> SCIE1100
-    NumWorkshops = {i: m.addConstr(quicksum(X_iw[i, w] for w in Workshops
-                                            if (i, w) in X_iw if '1100' not in Time_slots[w]) == M_i[i][0])
-                    for i in Tutors}
+    # M_i has two columns: M_i[:, 0] -> SCIE1000, M_i[:, 1] -> SCIE1100
+    NumWorkshops = m.addConstr(X_iw[:, ~is_1100].sum(axis=1) == M_i[:, 0])
 
     # Make sure each tutor is allocated the correct number of workshops for SCIE1100
-    NumWorkshops1100 = {i: m.addConstr(quicksum(X_iw[i, w] for w in Workshops
-                                                if (i, w) in X_iw if '1100' in Time_slots[w]) == M_i[i][1])
-                        for i in Tutors}
+    NumWorkshops1100 = m.addConstr(X_iw[:, is_1100].sum(axis=1) == M_i[:, 1])
 
 else:
     # If do_scie1100 != 'yes' and !='no', then something has gone wrong :(
     raise ValueError('Invalid input for whether or not SCIE1100 is running this semester.')
 
-# Tutors can teach at most one workshop at a time -> sum over all workshops on same day that overlap with workshop w
+# Tutors can teach at most one workshop at a time -> sum over each group of workshops that are all on at the same time
 # If the workshops start within an hour of each other, they will overlap, provided they are on the same day
-OnePlaceAtATime = {(i, w): m.addConstr(
-    quicksum(X_iw[i, v] for v in Workshops if (i, v) in X_iw
-             if abs(Workshop_time[v][0] - Workshop_time[w][0]) <= 100
-             if Workshop_day[v] == Workshop_day[w]) <= 1
-) for i in Tutors for w in Workshops}
+# (X_iw @ overlap_cliques.T)[i, c] is the number of workshops in group c that tutor i is allocated to
+OnePlaceAtATime = m.addConstr(X_iw @ overlap_cliques.T <= 1)
 
 # At least one experienced tutor per workshop (assuming that there are at least two tutors per workshop)
 # A tutor is experienced if their experience in the Excel sheet 'Allocations' = 1
-# If there are workshops with only one tutor, this constraint can be edited to: "workshop_exp_df.loc[i] == 0) <= 1"
+# If there are workshops with only one tutor, this constraint can be edited to: "X_iw[~experienced, :] ... <= 1"
 # to allow for inexperienced tutors tutoring by themselves (unlikely)
-AtMostOneInexp = {w: m.addConstr(
-    quicksum(X_iw[i, w] for i in Tutors if (i, w) in X_iw if workshop_exp_df.loc[i]['Experience'] == 1) >= 1)
-    for w in Workshops
-}
+AtMostOneInexp = m.addConstr(X_iw[experienced, :].sum(axis=0) >= 1)
 
 # If there are any conflicts
 if conflicts.lower() == 'yes':
     # Tutors with conflicts cannot teach together. Note: C_ij contains lists ij = [Tutor i, Tutor j]
-    NoConflicts = {(i, j, w): m.addConstr(X_iw[i, w] + X_iw[j, w] <= 1)
-                   for i, j in C_ij for w in Workshops if (i, w) in X_iw and (j, w) in X_iw}
+    # conflict_rows[n] = [tutor_idx[i], tutor_idx[j]] for the nth pair of tutors in C_ij. Pairs where a tutor isn't on
+    # the Availability sheet (e.g. a tutor from last semester, or a blank cell) are skipped.
+    conflict_rows = np.array([[tutor_idx[i], tutor_idx[j]] for i, j in C_ij if i in tutor_idx and j in tutor_idx],
+                             dtype=int).reshape(-1, 2)
+    NoConflicts = m.addConstr(X_iw[conflict_rows[:, 0], :] + X_iw[conflict_rows[:, 1], :] <= 1)
+
+# Rows of X_iw for the supertutors
+super_rows = np.array([tutor_idx[i] for i in Supertutors], dtype=int)
 
 # A supertutor is ideally teaching a workshop on the first day of workshops during the week.
 # This constraint can be removed if it makes the timetable infeasible.
-SupertutorWorkshop = {i: m.addConstr(
-    quicksum(X_iw[i, w] for w in Workshops if (i, w) in X_iw if first_workshop in Time_slots[w]) >= 1
-) for i in Supertutors}
+SupertutorWorkshop = m.addConstr(X_iw[super_rows][:, is_first_day].sum(axis=1) >= 1)
 
 # Supertutors shouldn't teach the same workshop - inefficient use of resources
 # This constraint can be removed if it makes the timetable infeasible.
-SupertutorOverlap = {w: m.addConstr(
-    quicksum(X_iw[i, w] for i in Supertutors if (i, w) in X_iw) <= 1
-) for w in Workshops}
+SupertutorOverlap = m.addConstr(X_iw[super_rows, :].sum(axis=0) <= 1)
 
 # Constraints for Y_ijw and Z_ijkw
 # We want Y_ijw = 1 if and only if X_iw = X_jw = 1 (see comment at definition of Y_ijw)
 # Y_ijw must be 0 if X_iw is 0, similarly if X_jw is 0 (remember that Y_ijw is binary
-Y_upperbound = {(i, j, w):
-                    [m.addConstr(Y_ijw[i, j, w] <= X_iw[i, w]),
-                     m.addConstr(Y_ijw[i, j, w] <= X_iw[j, w])]
-                for (i, j, w) in Y_ijw}
+Y_upperbound = [m.addConstr(Y_ijw <= X_iw[Y_rows[:, 0], Y_rows[:, 2]]),
+                m.addConstr(Y_ijw <= X_iw[Y_rows[:, 1], Y_rows[:, 2]])]
 
 # Y_ijw must be 1 if both X_iw and X_jw are 1
-Y_lowerbound = {(i, j, w): m.addConstr(Y_ijw[i, j, w] >= X_iw[i, w] + X_iw[j, w] - 1) for (i, j, w) in Y_ijw}
+Y_lowerbound = m.addConstr(Y_ijw >= X_iw[Y_rows[:, 0], Y_rows[:, 2]] + X_iw[Y_rows[:, 1], Y_rows[:, 2]] - 1)
 
 # Z_ijkw = 1 if and only if X_iw = X_jw = X_kw = 1, i.e. all three tutors are allocated to workshop w
-Z_upperbound = {(i, j, k, w):
-                    [m.addConstr(Z_ijkw[i, j, k, w] <= X_iw[i, w]),
-                     m.addConstr(Z_ijkw[i, j, k, w] <= X_iw[j, w]),
-                     m.addConstr(Z_ijkw[i, j, k, w] <= X_iw[k, w])]
-                for (i, j, k, w) in Z_ijkw}
+Z_upperbound = [m.addConstr(Z_ijkw <= X_iw[Z_rows[:, 0], Z_rows[:, 3]]),
+                m.addConstr(Z_ijkw <= X_iw[Z_rows[:, 1], Z_rows[:, 3]]),
+                m.addConstr(Z_ijkw <= X_iw[Z_rows[:, 2], Z_rows[:, 3]])]
 
 # Z_ijkw must be 1 if X_iw, X_jw, and X_kw are all 1
-Z_lowerbound = {(i, j, k, w): m.addConstr(Z_ijkw[i, j, k, w] >= X_iw[i, w] + X_iw[j, w] + X_iw[k, w] - 2)
-                for (i, j, k, w) in Z_ijkw}
+Z_lowerbound = m.addConstr(Z_ijkw >= X_iw[Z_rows[:, 0], Z_rows[:, 3]] + X_iw[Z_rows[:, 1], Z_rows[:, 3]]
+                           + X_iw[Z_rows[:, 2], Z_rows[:, 3]] - 2)
+
+# Workshops on at the same time with identical tutor availabilities (e.g. Tuesday 12pm-2pm ILC1 and ILC3) are
+# interchangeable: swapping their tutors gives an equally good timetable. Ordering these workshops stops the solver
+# from searching through every swap. Workshops are grouped if they have the same day, start time, number of tutors,
+# course, and tutor availabilities.
+workshop_groups = {}
+for w in Workshops:
+    key = (day_ids[w], start_times[w], N_w[w], is_1100[w], avail_matrix[:, w].tobytes())
+    workshop_groups.setdefault(key, []).append(w)
+
+# Within each group, the tutors allocated to a workshop must have a total row number in X_iw no larger than the tutors
+# allocated to the next workshop in the group. Any timetable can be reordered like this by swapping workshops' tutors.
+# If you manually schedule a tutor into one of these workshops (see below), comment out this constraint.
+tutor_numbers = np.arange(len(Tutors))
+WorkshopSymmetry = [m.addConstr(tutor_numbers @ X_iw[:, group[k]] <= tutor_numbers @ X_iw[:, group[k + 1]])
+                    for group in workshop_groups.values() for k in range(len(group) - 1)]
 
 # ------------- Manual constraints - tutor preferences -------------
 # Tutors can be manually scheduled by using the following line of code (replace occurrences of TUTOR with tutor's name,
 # and replace TIMESLOT with the name of the workshop as is appears in the list Time_slots)
 
-# TUTORPreference = m.addConstr(X_iw['TUTOR', Time_slots.index('TIMESLOT')] == 1)
+# TUTORPreference = m.addConstr(X_iw[tutor_idx['TUTOR'], Time_slots.index('TIMESLOT')] == 1)
 
 # Alternatively, you can include tutors' general preferences for a specific day or time with the following line of code
 # (replace occurrences of TUTOR with tutor's name, and DETAIL with the specific day or time, e.g. 'Mon' or '8am')
-# TUTORPreference = m.addConstr(quicksum(X_iw['TUTOR', w] for w in Workshops if DETAIL in Time_slots[w]) >= 1)
+# TUTORPreference = m.addConstr(X_iw[tutor_idx['TUTOR'], np.array([DETAIL in t for t in Time_slots])].sum() >= 1)
+
+# ------------- Warm start -------------
+# Start the solver from a greedy allocation, so it has a good timetable to improve on instead of starting from scratch.
+# course[w] is the column of M_i for workshop w: 0 -> SCIE1000, 1 -> SCIE1100
+if do_scie1100.lower() == 'yes':
+    course = is_1100.astype(int)
+else:
+    course = np.zeros(len(Workshops), dtype=int)
+
+X_iw.Start = greedy_allocation(avail_matrix, N_w, M_i, course, overlap)
+
+# ------------- Solver parameters -------------
+# Set Gurobi's random seed so that the same spreadsheet always gives the same timetable
+m.Params.Seed = 42
+# Use up to 8 CPU cores. More threads rarely help on a model this size.
+threads = min(8, os.cpu_count() or 1)
+m.Params.Threads = threads
+# Aggressive presolve: the many fixed (unavailable) X_iw entries and linking constraints simplify well
+m.Params.Presolve = 2
+# Focus on finding good feasible timetables quickly rather than on proving optimality
+m.Params.MIPFocus = 1
+m.Params.Heuristics = 0.1
+# Stop once the timetable is within 0.01% of optimal
+m.Params.MIPGap = 1e-4
+# Aggressive symmetry detection, for any symmetric workshops that WorkshopSymmetry doesn't cover
+m.Params.Symmetry = 2
+
+# ------------- Parameter tuning -------------
+# Running "python tutor_alloc_gurobi.py --tune" asks Gurobi to search for parameter settings that solve this model
+# faster (for up to 10 minutes), and saves the best settings to tutor_alloc.prm. Later runs load the saved settings,
+# since the model has the same structure every semester.
+if '--tune' in sys.argv[1:]:
+    m.Params.TuneTimeLimit = 600
+    m.Params.TuneResults = 1
+    m.tune()
+
+    # Load the best parameter settings found into the model, and save them for later runs
+    if m.TuneResultCount > 0:
+        m.getTuneResult(0)
+        m.write('tutor_alloc.prm')
+
+elif os.path.exists('tutor_alloc.prm'):
+    m.read('tutor_alloc.prm')
+
+    # The saved settings include the seed and number of threads of the machine that ran the tuning, so set them again
+    m.Params.Seed = 42
+    m.Params.Threads = threads
 
 m.optimize()
 
-# Save the results as a dataframe. For each workshop, mark the allocated tutors with an X_iw.
-results_df = DataFrame(index=np.array(Tutors), columns=np.array(Time_slots))
-for (i, w) in X_iw:
-    if X_iw[i, w].x > 0.9:
-        results_df.loc[i, Time_slots[w]] = 'X_iw'
+# Save the results as a dataframe. For each workshop, mark the allocated tutors with an X.
+# X_iw.X fetches the whole matrix of solution values at once. Unallocated entries are left blank (None).
+results_df = DataFrame(np.where(X_iw.X > 0.9, 'X', None), index=np.array(Tutors), columns=np.array(Time_slots))
 
 # Export the allocation dataframe to an Excel file
-results_df.to_excel('tutor_workshop_schedule_gurobi.xlsx', sheet_name='Timetable', index=True)
+results_df.to_excel('tutor_workshop_schedule_gurobi.xlsx', sheet_name='Timetable', index=True, engine=excel_engine)